@@ -11,6 +11,11 @@ import fitz # PyMuPDF
 from PIL import Image
 import io # Para lidar com bytes de bytes de imagem
 import json # Para salvar metadados de fichas uploadadas
+import hashlib # Para nomear as pastas de gravações sem colisões
+from transcricao_lote import (
+    PATIENT_RECORDS_FILE, MODELO_WHISPER, EXTENSOES_AUDIO,
+    transcrever_segmento, interpretar_comando, processar_pasta, carregar_json, salvar_json,
+)
 
 # --- Configurações iniciais da Página Streamlit ---
 st.set_page_config(page_title="Ficha Atendimento - Fisioterapia", layout="centered")
@@ -18,7 +23,8 @@ st.set_page_config(page_title="Ficha Atendimento - Fisioterapia", layout="center
 # --- Caminhos para Armazenamento ---
 UPLOADED_TEMPLATES_DIR = "dados/uploaded_fichas_templates"
 UPLOADED_TEMPLATES_INDEX_FILE = "dados/uploaded_fichas_index.json"
-PATIENT_RECORDS_FILE = "dados/patient_records.json" # Arquivo para persistir dados de pacientes
+BATCH_AUDIO_DIR = "dados/consultas_gravadas" # Gravações enviadas para transcrição em lote
+# PATIENT_RECORDS_FILE vem de transcricao_lote, compartilhado com a linha de comando
 
 # Garante que os diretórios existam
 os.makedirs(UPLOADED_TEMPLATES_DIR, exist_ok=True)
@@ -45,19 +51,34 @@ def save_uploaded_templates_index(index_data):
 # --- Funções para Persistência de Dados de Pacientes ---
 def load_patient_records():
     """Carrega os registros de pacientes existentes."""
-    if os.path.exists(PATIENT_RECORDS_FILE):
-        try:
-            with open(PATIENT_RECORDS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except json.JSONDecodeError:
-            st.warning(f"Erro ao ler {PATIENT_RECORDS_FILE}. Iniciando com dados de pacientes vazios.")
-            return {}
-    return {}
+    try:
+        return carregar_json(PATIENT_RECORDS_FILE)
+    except ValueError:
+        st.warning(f"Erro ao ler {PATIENT_RECORDS_FILE}. Iniciando com dados de pacientes vazios.")
+        return {}
 
 def save_patient_records(records_data):
     """Salva os registros de pacientes no arquivo JSON."""
-    with open(PATIENT_RECORDS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(records_data, f, indent=4, ensure_ascii=False)
+    # Escrita atômica compartilhada com a linha de comando, para nunca deixar o arquivo pela metade
+    salvar_json(PATIENT_RECORDS_FILE, records_data)
+
+def reload_patient_records():
+    """Relê os registros do disco antes de salvar, para não sobrescrever o que a linha de comando gravou.
+
+    Retorna False, sem alterar a sessão, se o arquivo estiver corrompido.
+    """
+    try:
+        st.session_state.pacientes = carregar_json(PATIENT_RECORDS_FILE)
+        return True
+    except ValueError as e:
+        st.error(f"{e} O arquivo de registros não será sobrescrito; corrija-o antes de salvar.")
+        return False
+
+def merge_disk_sessions(patient_key, ficha_key):
+    """Acrescenta à ficha aberta as sessões que só existem no disco (ex.: gravadas pela transcrição em lote)."""
+    disk_sessions = st.session_state.pacientes.get(patient_key, {}).get(ficha_key, {})
+    for session_name, session_text in disk_sessions.items():
+        st.session_state.conteudo_ficha_atual.setdefault(session_name, session_text)
 
 # --- Inicialização de Estados da Sessão Streamlit ---
 # Estes estados garantem que o aplicativo mantenha as informações entre as interações do usuário.
@@ -167,8 +188,8 @@ else:
         try:
             # Recomenda-se usar um modelo multilíngue maior ou um específico para pt-BR.
             # "base" é multilíngue, "small" é multilíngue e mais preciso.
-            model = whisper.load_model("base") # Ou "small", "medium" para melhor precisão
-            st.success("Modelo Whisper 'base' carregado!")
+            model = whisper.load_model(MODELO_WHISPER)
+            st.success(f"Modelo Whisper '{MODELO_WHISPER}' carregado!")
         except Exception as e:
             st.error(f"Erro ao carregar modelo Whisper: {e}. Verifique sua conexão ou instalação.")
             st.stop() # Interrompe a execução se o modelo não carregar
@@ -176,21 +197,6 @@ else:
 
     model = carregar_modelo()
 
-    def corrigir_termos(texto):
-        """Aplica correções a termos comuns na transcrição (ajustável)."""
-        correcoes = {
-            "tendinite": "tendinite",
-            "cervicalgia": "cervicalgia",
-            "lombar": "região lombar",
-            "reabilitação funcional": "reabilitação funcional",
-            "fisioterapia do ombro": "fisioterapia de ombro",
-            "dor nas costas": "algia na coluna",
-            # Adicione mais correções específicas da área de fisioterapia conforme necessário
-        }
-        for errado, certo in correcoes.items():
-            texto = texto.replace(errado, certo)
-        return texto
-
     class AudioProcessor(AudioProcessorBase):
         """Processador de áudio para transcrição em tempo real e comandos de voz."""
         def __init__(self) -> None:
@@ -204,56 +210,42 @@ else:
             # Processa a cada 5 segundos de áudio acumulado
             if len(self.buffer) > 32000 * 5:
                 audio_np = np.frombuffer(self.buffer, np.float32)
-                audio_np = whisper.pad_or_trim(audio_np)
-                
-                # Garante que o modelo esteja no dispositivo correto (CPU ou CUDA)
-                mel = whisper.log_mel_spectrogram(audio_np).to(model.device)
-                options = whisper.DecodingOptions(language="pt", fp16=False) # Especifica o idioma português
-                result = whisper.decode(model, mel, options)
-                
-                texto_transcrito_segmento = corrigir_termos(result.text).strip()
+                texto_transcrito_segmento = transcrever_segmento(model, audio_np)
                 st.session_state.last_transcription_segment = texto_transcrito_segmento
-                
-                comando_processado = False
-                texto_transcrito_lower = texto_transcrito_segmento.lower()
+
+                # O mesmo interpretador de comandos é usado pela transcrição em lote
+                comando = interpretar_comando(texto_transcrito_segmento)
+                nome_comando, argumento = comando if comando else (None, None)
 
                 # --- Comandos de controle de escuta (pausar/retomar anotação) ---
-                if "pausar anotação" in texto_transcrito_lower:
+                if nome_comando == "pausar_anotacao":
                     st.session_state.listening_active = False
                     st.session_state.last_transcription_segment = "" # Limpa a exibição do comando
-                    comando_processado = True
-                elif "retomar anotação" in texto_transcrito_lower:
+                elif nome_comando == "retomar_anotacao":
                     st.session_state.listening_active = True
                     st.session_state.last_transcription_segment = "" # Limpa a exibição do comando
-                    comando_processado = True
 
                 # --- Comandos para navegar entre sessões ---
-                match_mudar_sessao = re.search(r"ir para a sessão (\d+)", texto_transcrito_lower)
-                if match_mudar_sessao and not comando_processado:
-                    sessao_num = int(match_mudar_sessao.group(1))
-                    nova_sessao_nome = f"Sessão {sessao_num}"
+                elif nome_comando == "ir_para_sessao":
+                    nova_sessao_nome = f"Sessão {argumento}"
                     if nova_sessao_nome in st.session_state.conteudo_ficha_atual:
                         st.session_state.sessao_selecionada = nova_sessao_nome
                         st.success(f"Mudou para a {nova_sessao_nome}.")
-                        comando_processado = True
                         st.rerun()
                     else:
                         st.warning(f"Sessão '{nova_sessao_nome}' não existe. Crie-a primeiro.")
-                        comando_processado = True
-                
-                if "nova sessão" in texto_transcrito_lower and not comando_processado:
+
+                elif nome_comando == "nova_sessao":
                     proxima_sessao_num = len(st.session_state.conteudo_ficha_atual) + 1
                     nova_sessao_nome = f"Sessão {proxima_sessao_num}"
                     st.session_state.conteudo_ficha_atual[nova_sessao_nome] = ""
                     st.session_state.sessao_selecionada = nova_sessao_nome
                     st.success(f"Nova {nova_sessao_nome} criada.")
-                    comando_processado = True
                     st.rerun()
 
                 # --- Lógica para abrir Ficha Modelo (PDF padrão ou uploadado) via comando de voz ---
-                match_abrir_ficha_modelo = re.search(r"(?:abrir|mostrar) ficha de (.+)", texto_transcrito_lower)
-                if match_abrir_ficha_modelo and not comando_processado:
-                    ficha_solicitada = match_abrir_ficha_modelo.group(1).strip()
+                elif nome_comando == "abrir_ficha_modelo":
+                    ficha_solicitada = argumento
                     file_path_to_open = None
 
                     # Prioriza fichas uploadadas, depois as padrão
@@ -272,17 +264,13 @@ else:
                         st.session_state.conteudo_ficha_atual = {"Sessão 1": ""} # Inicia nova ficha com uma sessão padrão
                         st.session_state.sessao_selecionada = "Sessão 1"
                         st.success(f"Ficha '{ficha_solicitada.title()}' aberta. Veja o PDF como guia e insira as respostas abaixo.")
-                        comando_processado = True
                         st.rerun() # Força um rerun para atualizar a UI imediatamente com a nova ficha
                     else:
                         st.warning(f"Comando de ficha modelo '{ficha_solicitada}' não reconhecido.")
-                        comando_processado = True # Marca como processado para não adicionar ao texto geral
 
                 # --- Lógica para abrir ficha de paciente existente via comando de voz ---
-                match_abrir_paciente_ficha = re.search(r"abrir ficha do paciente (.+?) (?:de|da)? (.+)", texto_transcrito_lower)
-                if match_abrir_paciente_ficha and not comando_processado:
-                    nome_paciente_falado = match_abrir_paciente_ficha.group(1).strip()
-                    tipo_ficha_falado = match_abrir_paciente_ficha.group(2).strip()
+                elif nome_comando == "abrir_ficha_paciente":
+                    nome_paciente_falado, tipo_ficha_falado = argumento
                     
                     found_patient = None
                     # Busca parcial pelo nome do paciente para maior flexibilidade
@@ -308,19 +296,15 @@ else:
                             st.session_state.current_pdf_images = [] # Limpa visualização de PDF
                             
                             st.success(f"Ficha '{tipo_ficha_falado.title()}' do paciente '{found_patient.title()}' aberta e texto carregado!")
-                            comando_processado = True
                             st.rerun() # Força um rerun para atualizar a UI
                         else:
                             st.warning(f"Não foi possível encontrar a ficha '{tipo_ficha_falado.title()}' para o paciente '{found_patient.title()}'.")
-                            comando_processado = True
                     else:
                         st.warning(f"Paciente '{nome_paciente_falado.title()}' não encontrado.")
-                        comando_processado = True
 
                 # --- Lógica para criar uma nova ficha em branco via comando de voz ---
-                match_nova_ficha = re.search(r"nova ficha de (.+)", texto_transcrito_lower)
-                if match_nova_ficha and not comando_processado:
-                    tipo_nova_ficha = match_nova_ficha.group(1).strip()
+                elif nome_comando == "nova_ficha":
+                    tipo_nova_ficha = argumento
                     st.session_state.paciente_atual = None # Não há paciente associado inicialmente
                     st.session_state.tipo_ficha_aberta = f"Nova: {tipo_nova_ficha}" # Prefixo para indicar nova ficha
                     st.session_state.conteudo_ficha_atual = {"Sessão 1": ""} # Nova ficha com uma sessão padrão
@@ -329,11 +313,10 @@ else:
                     st.session_state.current_pdf_images = [] # Limpa visualização de PDF
                     
                     st.info(f"Preparando para nova ficha: '{tipo_nova_ficha.title()}'. Dite na Sessão 1.")
-                    comando_processado = True
                     st.rerun() # Força um rerun para atualizar a UI
 
                 # --- Adiciona a transcrição ao campo da sessão atual se nenhum comando foi processado e a escuta está ativa ---
-                if not comando_processado and st.session_state.listening_active:
+                if comando is None and st.session_state.listening_active:
                     if texto_transcrito_segmento and st.session_state.sessao_selecionada:
                         # Adiciona ao conteúdo da sessão atualmente selecionada
                         current_text_for_session = st.session_state.conteudo_ficha_atual.get(st.session_state.sessao_selecionada, "")
@@ -561,7 +544,73 @@ else:
         st.markdown(st.session_state.mic_status_message)
         if not st.session_state.listening_active:
             st.warning("Microfone em pausa. Comandos de voz para abrir fichas ainda funcionam, mas o ditado geral está pausado.")
-            
+
+        st.markdown("---")
+
+        # --- Seção de Transcrição em Lote de Consultas Gravadas ---
+        st.header("Consultas Gravadas")
+        arquivos_audio_lote = st.file_uploader(
+            "Envie as gravações das consultas (cada gravação vira uma sessão)",
+            type=[ext.lstrip(".") for ext in EXTENSOES_AUDIO],
+            accept_multiple_files=True,
+            key="file_uploader_lote_audio"
+        )
+        paciente_lote = st.selectbox(
+            "Paciente das gravações:",
+            [""] + sorted(st.session_state.pacientes.keys()) + ["-- Novo Paciente --"],
+            key="select_paciente_lote"
+        )
+        if paciente_lote == "-- Novo Paciente --":
+            paciente_lote = st.text_input("Nome do Novo Paciente:", key="new_patient_name_lote")
+        ficha_lote = st.text_input("Ficha de destino (Ex: Avaliação Postural)", key="ficha_lote_input")
+
+        if st.button("Transcrever Gravações", key="btn_transcrever_lote"):
+            if not arquivos_audio_lote or not paciente_lote or not ficha_lote:
+                st.warning("Envie as gravações e informe o paciente e a ficha de destino.")
+            elif reload_patient_records():
+                patient_key = paciente_lote.lower().strip()
+                ficha_key = ficha_lote.lower().strip()
+                # Uma pasta fixa por paciente e ficha permite retomar a transcrição do checkpoint.
+                # O hash de (paciente, ficha) evita que nomes diferentes caiam na mesma pasta após a sanitização.
+                sanitized_name = re.sub(r'[^a-zA-Z0-9_.-]', '', f"{patient_key}_{ficha_key}".replace(" ", "_"))
+                hash_destino = hashlib.sha1(json.dumps([patient_key, ficha_key]).encode("utf-8")).hexdigest()[:12]
+                pasta_lote = os.path.join(BATCH_AUDIO_DIR, f"{sanitized_name}_{hash_destino}")
+                os.makedirs(pasta_lote, exist_ok=True)
+
+                for arquivo_audio in arquivos_audio_lote:
+                    save_path = os.path.join(pasta_lote, os.path.basename(arquivo_audio.name))
+                    # Não regrava arquivos já enviados, senão seriam transcritos de novo
+                    if os.path.exists(save_path) and os.path.getsize(save_path) == arquivo_audio.size:
+                        continue
+                    with open(save_path, "wb") as f:
+                        f.write(arquivo_audio.getbuffer())
+
+                barra_progresso = st.progress(0.0, text="Preparando transcrição...")
+
+                def atualizar_progresso(concluidos, total, arquivo):
+                    barra_progresso.progress(concluidos / total if total else 1.0, text=f"{concluidos}/{total} gravações transcritas")
+
+                ficha_lote_aberta = st.session_state.paciente_atual == patient_key and st.session_state.tipo_ficha_aberta == ficha_key
+                # Reserva os nomes das sessões da ficha aberta, inclusive as ainda não salvas
+                sessoes_reservadas = set(st.session_state.conteudo_ficha_atual) if ficha_lote_aberta else set()
+                resumo = processar_pasta(
+                    pasta_lote, patient_key, ficha_key, PATIENT_RECORDS_FILE,
+                    progresso=atualizar_progresso, reservadas=sessoes_reservadas
+                )
+                for aviso in resumo["avisos"]:
+                    st.warning(aviso)
+                for arquivo, erro in resumo["erros"].items():
+                    st.error(f"Erro ao transcrever '{arquivo}': {erro}")
+                # Traz para a sessão do Streamlit o que processar_pasta acabou de gravar no disco
+                if resumo["sessoes"] and reload_patient_records() and ficha_lote_aberta:
+                    # Mostra as novas sessões na ficha aberta sem descartar o que ainda não foi salvo
+                    for nome_sessao in resumo["sessoes"]:
+                        st.session_state.conteudo_ficha_atual.setdefault(nome_sessao, st.session_state.pacientes[patient_key][ficha_key][nome_sessao])
+                if resumo["sessoes"]:
+                    st.success(f"{len(resumo['sessoes'])} sessões gravadas na ficha '{ficha_key.title()}' do paciente '{patient_key.title()}'.")
+                elif not resumo["erros"]:
+                    st.info("Todas as gravações já haviam sido transcritas para esta ficha.")
+
         st.markdown("---")
 
     with col2: # Coluna da direita para o conteúdo da ficha e transcrição
@@ -630,10 +679,12 @@ else:
         st.markdown("---")
         # Botão para salvar a ficha
         if st.session_state.tipo_ficha_aberta:
-            if st.button("Salvar Ficha", key="btn_save_ficha"):
+            # Relê os registros do disco para preservar o que a transcrição em lote gravou
+            if st.button("Salvar Ficha", key="btn_save_ficha") and reload_patient_records():
                 if st.session_state.paciente_atual:
                     # Se há um paciente atual, atualiza a ficha existente
-                    st.session_state.pacientes[st.session_state.paciente_atual][st.session_state.tipo_ficha_aberta] = st.session_state.conteudo_ficha_atual
+                    merge_disk_sessions(st.session_state.paciente_atual, st.session_state.tipo_ficha_aberta)
+                    st.session_state.pacientes.setdefault(st.session_state.paciente_atual, {})[st.session_state.tipo_ficha_aberta] = st.session_state.conteudo_ficha_atual
                     save_patient_records(st.session_state.pacientes) # Salva as alterações no arquivo
                     st.success(f"Ficha de '{st.session_state.tipo_ficha_aberta.title()}' do paciente '{st.session_state.paciente_atual.title()}' atualizada com sucesso!")
                     st.rerun() # Recarrega para limpar a mensagem de "Nome do Paciente para Salvar" se ela apareceu
@@ -646,6 +697,7 @@ else:
                             st.session_state.pacientes[patient_key] = {} # Cria uma nova entrada para o paciente se não existir
                         
                         ficha_name_to_save = st.session_state.tipo_ficha_aberta.replace("Nova: ", "").strip().lower()
+                        merge_disk_sessions(patient_key, ficha_name_to_save)
                         st.session_state.pacientes[patient_key][ficha_name_to_save] = st.session_state.conteudo_ficha_atual
                         save_patient_records(st.session_state.pacientes) # Salva no arquivo
                         st.success(f"Nova ficha '{ficha_name_to_save.title()}' salva para o paciente '{patient_key.title()}'!")
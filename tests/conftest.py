@@ -0,0 +1,15 @@
+import importlib
+import os
+import sys
+import types
+
+# Permite importar os módulos da raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# A lógica testada não decodifica nem transcreve áudio; substitui av/whisper
+# por módulos vazios quando não estão instalados
+for nome in ("av", "whisper"):
+    try:
+        importlib.import_module(nome)
+    except ImportError:
+        sys.modules[nome] = types.ModuleType(nome)
@@ -0,0 +1,175 @@
+import json
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pytest
+
+import transcricao_lote as tl
+
+TAXA = tl.TAXA_AMOSTRAGEM
+
+
+def fala(segundos):
+    rng = np.random.default_rng(0)
+    return (rng.standard_normal(int(segundos * TAXA)) * 0.1).astype(np.float32)
+
+
+def silencio(segundos):
+    return np.zeros(int(segundos * TAXA), dtype=np.float32)
+
+
+# --- interpretar_comando ---
+
+def test_interpretar_comando_prioridade():
+    # Pausar/retomar vêm antes da navegação, que vem antes de abrir fichas
+    assert tl.interpretar_comando("nova sessão e pausar anotação") == ("pausar_anotacao", None)
+    assert tl.interpretar_comando("nova sessão, ir para a sessão 2") == ("ir_para_sessao", 2)
+    assert tl.interpretar_comando("Nova Sessão") == ("nova_sessao", None)
+    assert tl.interpretar_comando("abrir ficha de coluna") == ("abrir_ficha_modelo", "coluna")
+    assert tl.interpretar_comando("nova ficha de ombro") == ("nova_ficha", "ombro")
+    assert tl.interpretar_comando("paciente relata dor") is None
+
+
+# --- segmentar_audio ---
+
+def test_segmentar_audio_corta_nas_pausas_e_descarta_silencio():
+    audio = np.concatenate([silencio(1), fala(2), silencio(1), fala(3), silencio(2)])
+    duracoes = [len(s) / TAXA for s in tl.segmentar_audio(audio)]
+    assert len(duracoes) == 2
+    assert duracoes[0] == pytest.approx(2 + 2 * tl.MARGEM_SEGUNDOS, abs=0.05)
+    assert duracoes[1] == pytest.approx(3 + 2 * tl.MARGEM_SEGUNDOS, abs=0.05)
+
+
+def test_segmentar_audio_silencio_total():
+    assert tl.segmentar_audio(silencio(3)) == []
+
+
+def test_segmentar_audio_fala_longa_corta_no_vale():
+    audio = fala(70)
+    for vale in (27, 55):
+        audio[int(vale * TAXA):int((vale + 0.09) * TAXA)] *= 0.2
+    segmentos = tl.segmentar_audio(audio)
+    duracoes = [len(s) / TAXA for s in segmentos]
+    assert all(d <= tl.SEGMENTO_MAX_SEGUNDOS for d in duracoes)
+    # Os cortes caem dentro dos vales, e não exatamente aos 30 s
+    cortes = np.cumsum(duracoes)[:-1]
+    assert 27 <= cortes[0] <= 27.09
+    assert 55 <= cortes[1] <= 55.09
+    # Nenhum pedaço de fala é perdido nem duplicado entre os cortes
+    assert sum(len(s) for s in segmentos) == pytest.approx(len(audio), abs=tl.QUADRO_SEGUNDOS * TAXA)
+
+
+# --- aplicar_transcricao ---
+
+def test_aplicar_transcricao_mantem_texto_em_volta_do_comando():
+    sessoes = {"Sessão 1": "anterior"}
+    criadas = tl.aplicar_transcricao(sessoes, ["Paciente relata dor lombar forte há três semanas, nova sessão", "texto"])
+    assert criadas == ["Sessão 2", "Sessão 3"]
+    assert sessoes["Sessão 2"] == "Paciente relata dor lombar forte há três semanas"
+    assert sessoes["Sessão 3"] == "texto"
+
+
+def test_aplicar_transcricao_nova_sessao_inicial_nao_cria_sessao_vazia():
+    sessoes = {}
+    assert tl.aplicar_transcricao(sessoes, ["Nova sessão. Alongamento feito."]) == ["Sessão 1"]
+    assert sessoes == {"Sessão 1": "Alongamento feito"}
+
+
+def test_aplicar_transcricao_pausar_retomar_e_ir_para_sessao():
+    sessoes = {"Sessão 1": "antiga"}
+    tl.aplicar_transcricao(sessoes, [
+        "gelo, pausar anotação conversa pessoal retomar anotação e calor",
+        "ir para a sessão 1, complemento",
+    ])
+    assert sessoes == {"Sessão 1": "antiga complemento", "Sessão 2": "gelo e calor"}
+
+
+def test_aplicar_transcricao_respeita_reservadas():
+    sessoes = {"Sessão 1": "a", "Sessão 2": "b"}
+    assert tl.aplicar_transcricao(sessoes, ["texto"], reservadas={"Sessão 3"}) == ["Sessão 4"]
+
+
+# --- processar_pasta (retomada pelo checkpoint) ---
+
+def preparar_pasta(pasta, segmentos_por_arquivo):
+    """Cria as gravações e um checkpoint já transcrito, para não precisar do pool."""
+    checkpoint = {}
+    for nome, segmentos in segmentos_por_arquivo.items():
+        caminho = pasta / nome
+        caminho.write_bytes(b"audio")
+        checkpoint[nome] = {"assinatura": tl._assinatura(str(caminho)), "segmentos": segmentos, "aplicado_em": None}
+    tl.salvar_json(str(pasta / tl.ARQUIVO_CHECKPOINT), checkpoint)
+
+
+def test_processar_pasta_retoma_e_nao_reaplica(tmp_path):
+    pasta = tmp_path / "gravacoes"
+    pasta.mkdir()
+    preparar_pasta(pasta, {"b.wav": ["segunda"], "a.wav": ["primeira"], "c.wav": []})
+    registros = tmp_path / "registros.json"
+    tl.salvar_json(str(registros), {"outro": {"ficha": {"Sessão 1": "x"}}})
+
+    resumo = tl.processar_pasta(str(pasta), "joão", "avaliação", str(registros))
+    assert resumo["sessoes"] == ["Sessão 1", "Sessão 2"]
+    assert resumo["erros"] == {}
+    assert any("c.wav" in aviso for aviso in resumo["avisos"])
+    dados = json.loads(registros.read_text(encoding="utf-8"))
+    assert dados["joão"]["avaliação"] == {"Sessão 1": "primeira", "Sessão 2": "segunda"}
+    assert dados["outro"] == {"ficha": {"Sessão 1": "x"}}
+
+    # Segunda execução: tudo já aplicado a este destino
+    assert tl.processar_pasta(str(pasta), "joão", "avaliação", str(registros))["sessoes"] == []
+    assert json.loads(registros.read_text(encoding="utf-8")) == dados
+
+
+def test_processar_pasta_registros_corrompidos_nao_sao_sobrescritos(tmp_path):
+    pasta = tmp_path / "gravacoes"
+    pasta.mkdir()
+    preparar_pasta(pasta, {"a.wav": ["texto"]})
+    registros = tmp_path / "registros.json"
+    registros.write_text("{corrompido", encoding="utf-8")
+
+    resumo = tl.processar_pasta(str(pasta), "joão", "avaliação", str(registros))
+    assert resumo["sessoes"] == []
+    assert resumo["avisos"]
+    assert registros.read_text(encoding="utf-8") == "{corrompido"
+    # A transcrição continua pendente de aplicação para a próxima execução
+    checkpoint = json.loads((pasta / tl.ARQUIVO_CHECKPOINT).read_text(encoding="utf-8"))
+    assert checkpoint["a.wav"]["aplicado_em"] is None
+
+
+def test_processar_pasta_pool_quebrado_ainda_aplica_checkpoint(tmp_path, monkeypatch):
+    class PoolQuebrado:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def submit(self, *args, **kwargs):
+            raise BrokenProcessPool("processo encerrado")
+
+    monkeypatch.setattr(tl, "ProcessPoolExecutor", PoolQuebrado)
+    pasta = tmp_path / "gravacoes"
+    pasta.mkdir()
+    preparar_pasta(pasta, {"a.wav": ["já transcrita"]})
+    (pasta / "b.wav").write_bytes(b"nova")
+    registros = tmp_path / "registros.json"
+
+    resumo = tl.processar_pasta(str(pasta), "joão", "avaliação", str(registros), processos=1)
+    assert list(resumo["erros"]) == ["b.wav"]
+    assert resumo["sessoes"] == ["Sessão 1"]
+    assert json.loads(registros.read_text(encoding="utf-8"))["joão"]["avaliação"] == {"Sessão 1": "já transcrita"}
+
+
+# --- salvar_json ---
+
+def test_salvar_json_nao_deixa_temporarios(tmp_path):
+    caminho = tmp_path / "dados" / "registros.json"
+    tl.salvar_json(str(caminho), {"a": 1})
+    tl.salvar_json(str(caminho), {"a": 2})
+    assert json.loads(caminho.read_text(encoding="utf-8")) == {"a": 2}
+    assert os.listdir(caminho.parent) == ["registros.json"]
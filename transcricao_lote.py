@@ -0,0 +1,474 @@
+"""Transcrição em lote de consultas gravadas.
+
+Decodifica uma pasta de arquivos de áudio com o `av`, divide cada gravação em
+trechos de fala e distribui os trechos entre processos do Whisper, usando todos
+os núcleos mesmo quando há uma única gravação longa. Cada gravação vira uma
+nova sessão na ficha do paciente escolhido, respeitando os mesmos comandos de
+voz do ditado ao vivo.
+
+O progresso é salvo em um checkpoint dentro da própria pasta, então uma
+execução interrompida pode ser retomada sem transcrever de novo o que já foi feito.
+
+A linha de comando pode rodar com o aplicativo aberto: os registros são relidos
+do disco logo antes de cada gravação, e ao salvar uma ficha o aplicativo mantém
+as sessões que a transcrição em lote acrescentou a ela.
+
+Uso pela linha de comando:
+    python transcricao_lote.py PASTA --paciente "Maria Silva" --ficha "avaliação postural"
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import av
+import numpy as np
+import whisper
+
+# --- Configurações ---
+PATIENT_RECORDS_FILE = "dados/patient_records.json" # Arquivo para persistir dados de pacientes
+MODELO_WHISPER = "base" # Ou "small", "medium" para melhor precisão
+ARQUIVO_CHECKPOINT = ".transcricao_lote.json" # Salvo dentro da pasta de gravações
+EXTENSOES_AUDIO = (".wav", ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac", ".webm", ".amr", ".3gp", ".mp4")
+
+TAXA_AMOSTRAGEM = 16000 # Taxa esperada pelo Whisper
+QUADRO_SEGUNDOS = 0.03 # Janela usada para medir a energia do sinal
+LIMIAR_SILENCIO = 0.005 # Energia (RMS) mínima para considerar um quadro como fala
+SILENCIO_MIN_SEGUNDOS = 0.6 # Pausas maiores que isso separam trechos
+MARGEM_SEGUNDOS = 0.2 # Contexto mantido antes e depois de cada trecho
+SEGMENTO_MAX_SEGUNDOS = 30 # Janela máxima do Whisper
+BUSCA_CORTE_SEGUNDOS = 5 # Fala contínua longa é cortada no quadro mais baixo desse final de janela
+
+# --- Funções Compartilhadas com o Ditado ao Vivo ---
+def corrigir_termos(texto):
+    """Aplica correções a termos comuns na transcrição (ajustável)."""
+    correcoes = {
+        "tendinite": "tendinite",
+        "cervicalgia": "cervicalgia",
+        "lombar": "região lombar",
+        "reabilitação funcional": "reabilitação funcional",
+        "fisioterapia do ombro": "fisioterapia de ombro",
+        "dor nas costas": "algia na coluna",
+        # Adicione mais correções específicas da área de fisioterapia conforme necessário
+    }
+    for errado, certo in correcoes.items():
+        texto = texto.replace(errado, certo)
+    return texto
+
+def transcrever_segmento(modelo, audio_np):
+    """Transcreve um trecho de áudio (float32, 16 kHz) e aplica as correções de termos."""
+    audio_np = whisper.pad_or_trim(audio_np)
+    # Garante que o modelo esteja no dispositivo correto (CPU ou CUDA)
+    mel = whisper.log_mel_spectrogram(audio_np).to(modelo.device)
+    options = whisper.DecodingOptions(language="pt", fp16=False) # Especifica o idioma português
+    result = whisper.decode(modelo, mel, options)
+    return corrigir_termos(result.text).strip()
+
+def _localizar_comandos(texto):
+    """Lista os comandos de voz presentes no texto, em ordem de prioridade.
+
+    Cada item é (comando, argumento, início, fim), com a posição da frase do comando no texto.
+    """
+    texto = texto.lower()
+    comandos = []
+
+    # --- Comandos de controle de escuta (pausar/retomar anotação) ---
+    for frase, comando in (("pausar anotação", "pausar_anotacao"), ("retomar anotação", "retomar_anotacao")):
+        inicio = texto.find(frase)
+        if inicio != -1:
+            comandos.append((comando, None, inicio, inicio + len(frase)))
+
+    # --- Comandos para navegar entre sessões ---
+    match_mudar_sessao = re.search(r"ir para a sessão (\d+)", texto)
+    if match_mudar_sessao:
+        comandos.append(("ir_para_sessao", int(match_mudar_sessao.group(1)), match_mudar_sessao.start(), match_mudar_sessao.end()))
+    inicio = texto.find("nova sessão")
+    if inicio != -1:
+        comandos.append(("nova_sessao", None, inicio, inicio + len("nova sessão")))
+
+    # --- Comandos para abrir ou criar fichas ---
+    match_abrir_ficha_modelo = re.search(r"(?:abrir|mostrar) ficha de (.+)", texto)
+    if match_abrir_ficha_modelo:
+        comandos.append(("abrir_ficha_modelo", match_abrir_ficha_modelo.group(1).strip(), match_abrir_ficha_modelo.start(), match_abrir_ficha_modelo.end()))
+    match_abrir_paciente_ficha = re.search(r"abrir ficha do paciente (.+?) (?:de|da)? (.+)", texto)
+    if match_abrir_paciente_ficha:
+        argumento = (match_abrir_paciente_ficha.group(1).strip(), match_abrir_paciente_ficha.group(2).strip())
+        comandos.append(("abrir_ficha_paciente", argumento, match_abrir_paciente_ficha.start(), match_abrir_paciente_ficha.end()))
+    match_nova_ficha = re.search(r"nova ficha de (.+)", texto)
+    if match_nova_ficha:
+        comandos.append(("nova_ficha", match_nova_ficha.group(1).strip(), match_nova_ficha.start(), match_nova_ficha.end()))
+    return comandos
+
+def interpretar_comando(texto):
+    """Identifica um comando de voz em um trecho transcrito.
+
+    Retorna uma tupla (comando, argumento) ou None se o trecho for ditado comum.
+    A ordem das verificações define a prioridade quando mais de um comando aparece.
+    """
+    comandos = _localizar_comandos(texto)
+    if not comandos:
+        return None
+    comando, argumento, _, _ = comandos[0]
+    return (comando, argumento)
+
+# --- Decodificação e Segmentação do Áudio ---
+def decodificar_audio(caminho):
+    """Decodifica um arquivo de áudio para mono float32 a 16 kHz."""
+    resampler = av.AudioResampler(format="flt", layout="mono", rate=TAXA_AMOSTRAGEM)
+    partes = []
+    with av.open(caminho) as container:
+        for frame in container.decode(audio=0):
+            frame.pts = None # Evita erros de timestamp em gravações de celular com pts irregulares
+            for convertido in resampler.resample(frame):
+                partes.append(convertido.to_ndarray().reshape(-1))
+        for convertido in resampler.resample(None): # Esvazia o buffer interno do resampler
+            partes.append(convertido.to_ndarray().reshape(-1))
+    if not partes:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(partes).astype(np.float32, copy=False)
+
+def segmentar_audio(audio_np):
+    """Divide o áudio em trechos de fala, cortando nas pausas e descartando o silêncio."""
+    tamanho_quadro = int(TAXA_AMOSTRAGEM * QUADRO_SEGUNDOS)
+    num_quadros = len(audio_np) // tamanho_quadro
+    if num_quadros == 0:
+        return []
+
+    quadros = audio_np[:num_quadros * tamanho_quadro].reshape(num_quadros, tamanho_quadro)
+    energia = np.sqrt(np.mean(quadros ** 2, axis=1))
+    # O limiar acompanha o volume da gravação, mas nunca fica abaixo do mínimo fixo
+    limiar = max(LIMIAR_SILENCIO, 0.1 * float(np.percentile(energia, 95)))
+
+    silencio_min = int(SILENCIO_MIN_SEGUNDOS / QUADRO_SEGUNDOS)
+    max_quadros = int(SEGMENTO_MAX_SEGUNDOS / QUADRO_SEGUNDOS)
+    margem = int(MARGEM_SEGUNDOS / QUADRO_SEGUNDOS)
+    busca_corte = int(BUSCA_CORTE_SEGUNDOS / QUADRO_SEGUNDOS)
+
+    trechos = [] # (primeiro quadro, quadro após o último, se terminou em corte forçado) de cada trecho de fala
+    inicio = ultimo = None
+    for i in np.flatnonzero(energia >= limiar):
+        if inicio is None:
+            inicio = i
+        elif i - ultimo > silencio_min:
+            trechos.append((inicio, ultimo + 1, False))
+            inicio = i
+        elif i + 1 - inicio > max_quadros:
+            # Fala sem pausa longa: corta no quadro de menor energia perto do limite,
+            # onde é mais provável haver um intervalo entre palavras
+            janela = energia[inicio + max_quadros - busca_corte:inicio + max_quadros]
+            corte = inicio + max_quadros - busca_corte + int(np.argmin(janela))
+            trechos.append((inicio, corte, True))
+            inicio = corte
+        ultimo = i
+    if inicio is not None:
+        trechos.append((inicio, ultimo + 1, False))
+
+    segmentos = []
+    fim_anterior = 0
+    for inicio, fim, corte_forcado in trechos:
+        # Acrescenta a margem sem invadir o trecho anterior nem passar da janela do Whisper;
+        # num corte forçado o fim fica no quadro escolhido, para o trecho seguinte começar ali
+        inicio = max(inicio - margem, fim_anterior)
+        if not corte_forcado:
+            fim = min(fim + margem, num_quadros)
+        fim = min(fim, inicio + max_quadros)
+        segmentos.append(audio_np[inicio * tamanho_quadro:fim * tamanho_quadro])
+        fim_anterior = fim
+    return segmentos
+
+# --- Processos de Transcrição ---
+_modelo_processo = None # Modelo Whisper carregado uma vez por processo do pool
+
+def _inicializar_processo(nome_modelo, threads):
+    """Carrega o modelo Whisper no processo do pool."""
+    global _modelo_processo
+    import torch
+    # Divide os núcleos entre os processos para não disputarem threads do torch
+    torch.set_num_threads(threads)
+    _modelo_processo = whisper.load_model(nome_modelo)
+
+def _decodificar_e_segmentar(caminho):
+    """Decodifica uma gravação e retorna seus trechos de fala."""
+    return segmentar_audio(decodificar_audio(caminho))
+
+def _transcrever_trecho(segmento):
+    """Transcreve um trecho de fala com o modelo do processo."""
+    return transcrever_segmento(_modelo_processo, segmento)
+
+# --- Checkpoint e Registros ---
+def carregar_json(caminho):
+    """Carrega um arquivo JSON, retornando um dicionário vazio se não existir.
+
+    Levanta ValueError se o arquivo estiver corrompido, para que o chamador decida
+    entre descartá-lo ou recusar sobrescrevê-lo.
+    """
+    if os.path.exists(caminho):
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Erro ao ler {caminho}: {e}.") from e
+    return {}
+
+def salvar_json(caminho, dados):
+    """Salva um dicionário em JSON de forma atômica (arquivo temporário + rename)."""
+    pasta = os.path.dirname(caminho) or "."
+    os.makedirs(pasta, exist_ok=True)
+    # Temporário único por escrita, para o aplicativo e a linha de comando poderem salvar ao mesmo tempo
+    fd, caminho_tmp = tempfile.mkstemp(dir=pasta, prefix=os.path.basename(caminho) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(dados, f, indent=4, ensure_ascii=False)
+        os.replace(caminho_tmp, caminho)
+    except BaseException:
+        os.remove(caminho_tmp)
+        raise
+
+def listar_audios(pasta):
+    """Lista, em ordem alfabética, os arquivos de áudio de uma pasta."""
+    return sorted(
+        nome for nome in os.listdir(pasta)
+        if nome.lower().endswith(EXTENSOES_AUDIO) and os.path.isfile(os.path.join(pasta, nome))
+    )
+
+def _assinatura(caminho):
+    """Identifica uma versão do arquivo pelo tamanho e data de modificação."""
+    info = os.stat(caminho)
+    return [info.st_size, int(info.st_mtime)]
+
+def _proxima_sessao(sessoes, reservadas=()):
+    """Retorna o nome da próxima sessão livre da ficha, sem usar os nomes reservados."""
+    numero = len(sessoes) + 1
+    while f"Sessão {numero}" in sessoes or f"Sessão {numero}" in reservadas:
+        numero += 1
+    return f"Sessão {numero}"
+
+def aplicar_transcricao(sessoes, segmentos, reservadas=()):
+    """Grava os trechos de uma gravação como nova sessão, executando os comandos de voz.
+
+    Retorna a lista de sessões criadas. Um trecho pode ter até 30 s, então o ditado
+    antes e depois da frase de um comando é mantido. Comandos de abrir ou criar
+    fichas são ignorados, pois o paciente e a ficha de destino já foram escolhidos.
+    Nomes em `reservadas` nunca são usados para as sessões novas.
+    """
+    criadas = []
+    sessao_atual = None # Sessão nova só é criada quando recebe texto, evitando sessões vazias
+    escuta_ativa = True
+
+    def anotar(texto):
+        nonlocal sessao_atual
+        texto = texto.strip(" ,.;:")
+        if not texto or not escuta_ativa:
+            return
+        if sessao_atual is None:
+            sessao_atual = _proxima_sessao(sessoes, reservadas)
+            sessoes[sessao_atual] = ""
+            criadas.append(sessao_atual)
+        sessoes[sessao_atual] = (sessoes[sessao_atual] + " " + texto).strip()
+
+    for texto in segmentos:
+        while True:
+            comandos = _localizar_comandos(texto)
+            if not comandos:
+                anotar(texto)
+                break
+            # Executa os comandos na ordem em que foram falados
+            nome_comando, argumento, inicio, fim = min(comandos, key=lambda c: c[2])
+            anotar(texto[:inicio])
+            texto = texto[fim:]
+
+            if nome_comando == "pausar_anotacao":
+                escuta_ativa = False
+            elif nome_comando == "retomar_anotacao":
+                escuta_ativa = True
+            elif nome_comando == "ir_para_sessao":
+                if f"Sessão {argumento}" in sessoes:
+                    sessao_atual = f"Sessão {argumento}"
+            elif nome_comando == "nova_sessao":
+                sessao_atual = None
+    return criadas
+
+def processar_pasta(pasta, paciente, ficha, caminho_registros=PATIENT_RECORDS_FILE, processos=None, progresso=None, nome_modelo=MODELO_WHISPER, reservadas=()):
+    """Transcreve as gravações de uma pasta e grava cada uma como sessão da ficha do paciente.
+
+    O arquivo de registros ({paciente: {ficha: {sessão: texto}}}) só é lido depois
+    da transcrição, logo antes de gravar as sessões, e salvo em seguida. Assim o que
+    o aplicativo ou outra execução salvou enquanto isso não é perdido. `progresso`,
+    se informado, é chamado como `progresso(concluidos, total, arquivo)`.
+    `reservadas` são nomes de sessão que as novas sessões não podem usar, como as
+    sessões ainda não salvas da ficha aberta no aplicativo.
+
+    Retorna um dicionário com as sessões criadas, os erros por arquivo e avisos.
+    """
+    arquivos = listar_audios(pasta)
+    caminho_checkpoint = os.path.join(pasta, ARQUIVO_CHECKPOINT)
+    avisos = []
+    try:
+        checkpoint = carregar_json(caminho_checkpoint)
+    except ValueError as e:
+        # Guarda o arquivo corrompido para conferência e recomeça a transcrição do zero
+        os.replace(caminho_checkpoint, caminho_checkpoint + ".corrompido")
+        avisos.append(f"{e} Checkpoint descartado; gravações já aplicadas podem gerar sessões repetidas.")
+        checkpoint = {}
+    assinaturas = {arquivo: _assinatura(os.path.join(pasta, arquivo)) for arquivo in arquivos}
+
+    # Só transcreve gravações novas ou alteradas desde a última execução
+    pendentes = [a for a in arquivos if checkpoint.get(a, {}).get("assinatura") != assinaturas[a]]
+    total = len(arquivos)
+    concluidos = total - len(pendentes)
+    erros = {}
+    if progresso:
+        progresso(concluidos, total, None)
+
+    if pendentes:
+        num_processos = processos or os.cpu_count() or 1
+        try:
+            # "spawn" evita copiar o estado do servidor Streamlit para os processos filhos
+            with ProcessPoolExecutor(
+                max_workers=num_processos,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_inicializar_processo,
+                initargs=(nome_modelo, max(1, (os.cpu_count() or 1) // num_processos)),
+            ) as executor:
+                tarefas = {} # futuro -> (arquivo, índice do trecho ou None para a decodificação)
+                textos = {} # arquivo -> textos dos trechos, na ordem da gravação
+                faltando = {} # arquivo -> trechos ainda não transcritos
+                por_decodificar = list(pendentes)
+
+                def abastecer():
+                    # Só decodifica a próxima gravação quando a fila de trechos está curta, limitando a memória
+                    while por_decodificar and len(tarefas) < 2 * num_processos:
+                        arquivo = por_decodificar.pop(0)
+                        tarefas[executor.submit(_decodificar_e_segmentar, os.path.join(pasta, arquivo))] = (arquivo, None)
+
+                abastecer()
+                while tarefas:
+                    prontas, _ = wait(tarefas, return_when=FIRST_COMPLETED)
+                    for futuro in prontas:
+                        arquivo, indice = tarefas.pop(futuro)
+                        if arquivo in erros:
+                            continue # Trechos restantes de uma gravação que já falhou
+                        try:
+                            resultado = futuro.result()
+                        except Exception as e:
+                            erros[arquivo] = str(e)
+                            concluidos += 1
+                            if progresso:
+                                progresso(concluidos, total, arquivo)
+                            continue
+
+                        if indice is None:
+                            # Gravação decodificada: distribui os trechos entre os processos
+                            textos[arquivo] = [""] * len(resultado)
+                            faltando[arquivo] = len(resultado)
+                            for i, segmento in enumerate(resultado):
+                                tarefas[executor.submit(_transcrever_trecho, segmento)] = (arquivo, i)
+                        else:
+                            textos[arquivo][indice] = resultado
+                            faltando[arquivo] -= 1
+
+                        if faltando[arquivo] == 0:
+                            segmentos = [texto for texto in textos.pop(arquivo) if texto]
+                            checkpoint[arquivo] = {"assinatura": assinaturas[arquivo], "segmentos": segmentos, "aplicado_em": None}
+                            salvar_json(caminho_checkpoint, checkpoint)
+                            concluidos += 1
+                            if progresso:
+                                progresso(concluidos, total, arquivo)
+                    abastecer()
+        except BrokenProcessPool as e:
+            # Um processo morreu (falta de memória, falha ao carregar o modelo...): o pool inteiro
+            # fica inutilizável. As gravações sem checkpoint ficam como erro para a próxima execução,
+            # e as já transcritas ainda são gravadas abaixo.
+            for arquivo in pendentes:
+                if arquivo not in erros and checkpoint.get(arquivo, {}).get("assinatura") != assinaturas[arquivo]:
+                    erros[arquivo] = f"Transcrição interrompida: {e}"
+
+    # Grava as sessões na ordem dos arquivos, independente da ordem de conclusão
+    destino = f"{paciente}/{ficha}"
+    criadas = []
+    a_aplicar = [
+        arquivo for arquivo in arquivos
+        if arquivo in checkpoint
+        and checkpoint[arquivo]["assinatura"] == assinaturas[arquivo]
+        and checkpoint[arquivo]["aplicado_em"] != destino
+    ]
+    if not a_aplicar:
+        return {"sessoes": criadas, "erros": erros, "avisos": avisos}
+
+    try:
+        registros = carregar_json(caminho_registros)
+    except ValueError as e:
+        # Começar de {} apagaria os pacientes existentes; as transcrições continuam no checkpoint
+        avisos.append(f"{e} O arquivo de registros não foi sobrescrito; as sessões serão gravadas na próxima execução.")
+        return {"sessoes": criadas, "erros": erros, "avisos": avisos}
+
+    for arquivo in a_aplicar:
+        entrada = checkpoint[arquivo]
+        if entrada["segmentos"]:
+            sessoes = registros.setdefault(paciente, {}).setdefault(ficha, {})
+            criadas += aplicar_transcricao(sessoes, entrada["segmentos"], reservadas)
+        else:
+            # Sem fala detectada: não cria uma sessão em branco, só avisa
+            avisos.append(f"Nenhuma fala detectada em '{arquivo}'; nenhuma sessão criada.")
+        entrada["aplicado_em"] = destino
+
+    if criadas:
+        # Registros primeiro: se falhar aqui, o checkpoint ainda não marca as gravações como aplicadas
+        salvar_json(caminho_registros, registros)
+    salvar_json(caminho_checkpoint, checkpoint)
+    return {"sessoes": criadas, "erros": erros, "avisos": avisos}
+
+# --- Linha de Comando ---
+def main():
+    parser = argparse.ArgumentParser(description="Transcreve em lote consultas gravadas para a ficha de um paciente.")
+    parser.add_argument("pasta", help="Pasta com as gravações das consultas")
+    parser.add_argument("--paciente", required=True, help="Nome do paciente")
+    parser.add_argument("--ficha", required=True, help="Ficha do paciente onde as sessões serão gravadas")
+    parser.add_argument("--processos", type=int, default=None, help="Número de processos (padrão: um por núcleo)")
+    parser.add_argument("--registros", default=PATIENT_RECORDS_FILE, help="Arquivo de registros de pacientes")
+    parser.add_argument("--modelo", default=MODELO_WHISPER, help="Modelo Whisper a usar")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.pasta):
+        parser.error(f"Pasta '{args.pasta}' não encontrada.")
+    if args.processos is not None and args.processos < 1:
+        parser.error("--processos deve ser pelo menos 1.")
+
+    def mostrar_progresso(concluidos, total, arquivo):
+        if arquivo:
+            print(f"[{concluidos}/{total}] {arquivo}")
+        else:
+            print(f"{total} gravações encontradas, {concluidos} já transcritas.")
+
+    try:
+        # Só confere o arquivo antes de começar; processar_pasta o relê ao gravar as sessões
+        carregar_json(args.registros)
+    except ValueError as e:
+        # Começar de {} apagaria os pacientes existentes no próximo salvamento
+        print(f"{e} O arquivo de registros não será sobrescrito; corrija-o e rode novamente.", file=sys.stderr)
+        return 1
+
+    resumo = processar_pasta(
+        args.pasta,
+        args.paciente.lower().strip(), # Mesma normalização usada pelo aplicativo
+        args.ficha.lower().strip(),
+        args.registros,
+        processos=args.processos,
+        progresso=mostrar_progresso,
+        nome_modelo=args.modelo,
+    )
+
+    print(f"{len(resumo['sessoes'])} sessões gravadas: {', '.join(resumo['sessoes']) or '-'}")
+    for aviso in resumo["avisos"]:
+        print(f"Aviso: {aviso}", file=sys.stderr)
+    for arquivo, erro in resumo["erros"].items():
+        print(f"Erro em '{arquivo}': {erro}", file=sys.stderr)
+    return 1 if resumo["erros"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())